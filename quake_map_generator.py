@@ -6,105 +6,329 @@ Demonstrates procedural level generation and map file manipulation
 
 import math
 import os
+from collections import namedtuple
+from operator import itemgetter
+from types import MappingProxyType
+
+Entity = namedtuple("Entity", "classname properties brushes")
+Brush = namedtuple("Brush", "min_point max_point texture")
+
+# Shared read-only properties for entities that have none
+_NO_PROPERTIES = MappingProxyType({})
+
+# Pre-encoded fragments; the map is assembled as ASCII bytes
+_HEADER = (
+    b"// Game: Quake\n"
+    b"// Format: Standard\n"
+    b"// entity 0\n"
+    b"{\n"
+    b'"classname" "worldspawn"\n'
+)
+_OPEN_BRACE = b"{\n"
+_CLOSE_BRACE = b"}\n"
+
+# O_BINARY keeps Windows from translating newlines; it is 0 elsewhere
+_OPEN_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+# Output is handed to the OS in blocks of about this size
+_FLUSH_SIZE = 1 << 20
+# Worldspawn brushes are formatted in batches of this many (~1 MiB of text)
+_BRUSH_BATCH = 2048
+# Rough output sizes used to preallocate the scratch buffer
+_BRUSH_SIZE_ESTIMATE = 6 * 80
+_ENTITY_SIZE_ESTIMATE = 256
+
+# Double quotes inside quoted .map strings are backslash-escaped, as TrenchBroom
+# does; backslashes are left alone because the engine reads sequences like \n
+_ESCAPE = str.maketrans({'"': '\\"'})
+
+
+class _EncodedCache(dict):
+    """Maps keys to their encoded .map text, building each entry on first use"""
+
+    def __init__(self, encode):
+        super().__init__()
+        self._encode = encode
+
+    def __missing__(self, key):
+        value = self[key] = self._encode(key)
+        return value
+
+
+def _check_ascii(text, what):
+    """Reject text the ASCII .map output cannot hold, before any file is touched"""
+    if not text.isascii():
+        raise ValueError(f"{what} must be ASCII: {text!r}")
+
+
+def _encode_texture(texture):
+    return texture.encode("ascii")
+
+
+def _encode_classname_line(classname):
+    return ('"classname" "%s"\n' % classname.translate(_ESCAPE)).encode("ascii")
+
+
+def _encode_property_line(item):
+    key, value = item
+    return (
+        '"%s" "%s"\n' % (str(key).translate(_ESCAPE), str(value).translate(_ESCAPE))
+    ).encode("ascii")
+
+
+def _box_values(corner_sel):
+    """
+    Build a getter that turns (x1, y1, z1, x2, y2, z2, texture) into the
+    full argument tuple for a six-plane brush format
+    """
+    indices = []
+    for plane in corner_sel:
+        for point in plane:
+            indices += (sel * 3 + axis for axis, sel in enumerate(point))
+        indices.append(6)
+    return itemgetter(*indices)
 
 
 class QuakeMapWriter:
     """Handles writing Quake .map files in proper format"""
 
+    # Format: ( x1 y1 z1 ) ( x2 y2 z2 ) ( x3 y3 z3 ) TEXTURE x_offset y_offset rotation x_scale y_scale
+    _PLANE_FMT = b"( %d %d %d ) ( %d %d %d ) ( %d %d %d ) %b 0 0 0 1 1\n"
+    # A whole six-plane box brush, formatted in one pass
+    _BRUSH_FMT = _OPEN_BRACE + _PLANE_FMT * 6 + _CLOSE_BRACE
+
+    # Each plane picks 3 box corners in counter-clockwise order when viewed from
+    # outside; every corner is an (x, y, z) selector where 0 = min and 1 = max.
+    _CORNER_SEL = (
+        ((0, 1, 1), (1, 1, 1), (1, 0, 1)),  # Top face (looking down, CCW)
+        ((0, 0, 0), (1, 0, 0), (1, 1, 0)),  # Bottom face (looking up, CCW)
+        ((0, 1, 1), (0, 1, 0), (1, 1, 0)),  # North face (+Y)
+        ((1, 0, 1), (1, 0, 0), (0, 0, 0)),  # South face (-Y)
+        ((1, 0, 1), (1, 0, 0), (1, 1, 0)),  # East face (+X)
+        ((0, 1, 1), (0, 1, 0), (0, 0, 0)),  # West face (-X)
+    )
+    # Corner selection baked into a single C-level gather per box
+    _BOX_VALUES = _box_values(_CORNER_SEL)
+
     def __init__(self, filename):
         self.filename = filename
-        self.entities = []
+        # Entities are partitioned as they are added so write() needs no filtering
+        self._worldspawn_brushes = []
+        self._other_entities = []
+        # Encoded textures and entity lines, shared by every repeat of the same text
+        self._textures = _EncodedCache(_encode_texture)
+        self._classname_lines = _EncodedCache(_encode_classname_line)
+        # Only str-to-str properties are cached: values that merely compare equal
+        # (300 and 300.0, 1 and True) must still be written with their own str()
+        self._property_lines = _EncodedCache(_encode_property_line)
+        # Output accumulates in _scratch[:_pos] and is flushed in large blocks;
+        # the buffer keeps its allocation between flushes
+        self._scratch = bytearray()
+        self._pos = 0
+        # Descriptor of the map file while it is open for streaming
+        self._fd = None
+        # Number of brushes written so far
         self.brush_id = 0
 
     def create_box_brush(self, min_point, max_point, texture="__TB_empty"):
         """
         Create a simple box brush with proper plane winding
-        Quake brushes are defined by planes, not vertices
+        Quake brushes are defined by planes, not vertices; the box is kept as
+        a Brush(min_point, max_point, texture) and its planes are expanded on write.
+        Coordinates are snapped to ints here so the writer never has to convert them
         """
+        _check_ascii(texture, "texture")
         x1, y1, z1 = min_point
         x2, y2, z2 = max_point
-
-        # Each plane needs 3 points in counter-clockwise order when viewed from outside
-        # Format: ( x y z ) ( x y z ) ( x y z ) TEXTURE xoff yoff rot xscale yscale
-
-        planes = [
-            # Top face (looking down, CCW)
-            [(x1, y2, z2), (x2, y2, z2), (x2, y1, z2)],
-            # Bottom face (looking up, CCW)
-            [(x1, y1, z1), (x2, y1, z1), (x2, y2, z1)],
-            # North face (+Y)
-            [(x1, y2, z2), (x1, y2, z1), (x2, y2, z1)],
-            # South face (-Y)
-            [(x2, y1, z2), (x2, y1, z1), (x1, y1, z1)],
-            # East face (+X)
-            [(x2, y1, z2), (x2, y1, z1), (x2, y2, z1)],
-            # West face (-X)
-            [(x1, y2, z2), (x1, y2, z1), (x1, y1, z1)],
-        ]
-
-        return {"planes": planes, "texture": texture}
+        return Brush((int(x1), int(y1), int(z1)), (int(x2), int(y2), int(z2)), texture)
 
     def add_entity(self, classname, properties=None, brushes=None):
         """Add an entity (point entity or brush entity)"""
-        entity = {
-            "classname": classname,
-            "properties": properties or {},
-            "brushes": brushes or [],
-        }
-        self.entities.append(entity)
+        _check_ascii(classname, "classname")
+        if properties:
+            for key, value in properties.items():
+                _check_ascii(str(key), "property key")
+                _check_ascii(str(value), "property value")
+
+        if classname == "worldspawn":
+            if brushes:
+                self._worldspawn_brushes.extend(brushes)
+            return
+
+        self._other_entities.append(
+            Entity(
+                classname,
+                properties if properties is not None else _NO_PROPERTIES,
+                brushes if brushes is not None else (),
+            )
+        )
 
     def write(self):
         """Write the .map file"""
-        with open(self.filename, "w") as f:
-            # Write header comment
-            f.write("// Game: Quake\n")
-            f.write("// Format: Standard\n")
-            f.write("// entity 0\n")
-            f.write("{\n")
-            f.write('"classname" "worldspawn"\n')
-
-            # Write worldspawn brushes
-            worldspawn_brushes = [
-                e for e in self.entities if e["classname"] == "worldspawn"
-            ]
-            if worldspawn_brushes:
-                for brush in worldspawn_brushes[0]["brushes"]:
-                    self._write_brush(f, brush)
-
-            f.write("}\n")
+        self.open()
+        self.close()
 
-            # Write other entities
-            entity_num = 1
-            for entity in self.entities:
-                if entity["classname"] != "worldspawn":
-                    f.write(f"// entity {entity_num}\n")
-                    f.write("{\n")
-                    f.write(f'"classname" "{entity["classname"]}"\n')
+    def open(self):
+        """
+        Open the .map file and write the worldspawn header, so brushes can be
+        streamed with write_worldspawn_brush() instead of held until close()
+        """
+        if self._fd is not None:
+            raise ValueError(f"{self.filename} is already open")
 
-                    for key, value in entity["properties"].items():
-                        f.write(f'"{key}" "{value}"\n')
+        self._pos = 0
+        self.brush_id = 0
+        self._reserve()
+        # .map files are plain ASCII; bytes go straight to the descriptor
+        self._fd = os.open(self.filename, _OPEN_FLAGS, 0o644)
 
-                    for brush in entity["brushes"]:
-                        self._write_brush(f, brush)
+        # Write header comment
+        self._append(_HEADER)
 
-                    f.write("}\n")
-                    entity_num += 1
+    def write_worldspawn_brush(self, min_point, max_point, texture="__TB_empty"):
+        """Write a worldspawn box brush to the open file right away"""
+        self._check_open()
+        _check_ascii(texture, "texture")
+        x1, y1, z1 = min_point
+        x2, y2, z2 = max_point
+        self._emit_box(
+            (int(x1), int(y1), int(z1)), (int(x2), int(y2), int(z2)), texture
+        )
+        self.brush_id += 1
+        if self._pos >= _FLUSH_SIZE:
+            self._flush()
+
+    def __enter__(self):
+        self.open()
+        return self
 
-    def _write_brush(self, f, brush):
-        """Write a single brush in Quake .map format"""
-        f.write("{\n")
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._abort()
 
-        for plane in brush["planes"]:
-            # Each plane is defined by 3 points
-            p1, p2, p3 = plane
+    def close(self):
+        """
+        Finish the worldspawn entity, write all other entities and close the file;
+        if writing fails, the partial file is removed
+        """
+        self._check_open()
+        append = self._append
+        textures = self._textures
+        classname_lines = self._classname_lines
+        property_lines = self._property_lines
+        try:
+            # Write worldspawn brushes added through add_entity()
+            brushes = self._worldspawn_brushes
+            for start in range(0, len(brushes), _BRUSH_BATCH):
+                append(_format_brushes(brushes[start : start + _BRUSH_BATCH], textures))
+                if self._pos >= _FLUSH_SIZE:
+                    self._flush()
+            self.brush_id += len(brushes)
+
+            append(_CLOSE_BRACE)
+
+            # Write other entities
+            for entity_num, entity in enumerate(self._other_entities, 1):
+                append(b"// entity %d\n" % entity_num)
+                append(_OPEN_BRACE)
+                append(classname_lines[entity.classname])
+
+                for item in entity.properties.items():
+                    key, value = item
+                    if type(key) is str and type(value) is str:
+                        append(property_lines[item])
+                    else:
+                        append(_encode_property_line(item))
+
+                for brush in entity.brushes:
+                    self._write_brush(brush)
+
+                append(_CLOSE_BRACE)
+                if self._pos >= _FLUSH_SIZE:
+                    self._flush()
+
+            self._flush()
+        except BaseException:
+            # Never leave a truncated .map behind
+            self._abort()
+            raise
+
+        os.close(self._fd)
+        self._fd = None
+
+    def _abort(self):
+        """Close the file without finishing it and remove the partial output"""
+        self._pos = 0
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            os.remove(self.filename)
+
+    def _check_open(self):
+        if self._fd is None:
+            raise ValueError(f"{self.filename} is not open; call open() first")
+
+    def _reserve(self):
+        """Preallocate the scratch buffer for the expected output, up to two flushes"""
+        brush_count = len(self._worldspawn_brushes)
+        for entity in self._other_entities:
+            brush_count += len(entity.brushes)
+        estimate = (
+            brush_count * _BRUSH_SIZE_ESTIMATE
+            + (len(self._other_entities) + 1) * _ENTITY_SIZE_ESTIMATE
+        )
+        size = min(estimate, 2 * _FLUSH_SIZE)
+        # Grow in place so anything already buffered in _scratch[:_pos] is kept
+        if len(self._scratch) < size:
+            self._scratch.extend(bytes(size - len(self._scratch)))
+
+    def _append(self, chunk):
+        """Copy chunk into the scratch buffer, doubling the buffer when it is full"""
+        buf = self._scratch
+        pos = self._pos
+        end = pos + len(chunk)
+        if end > len(buf):
+            buf.extend(bytes(max(end, 2 * len(buf)) - len(buf)))
+        buf[pos:end] = chunk
+        self._pos = end
+
+    def _flush(self):
+        """Write out everything in the scratch buffer and empty it"""
+        written = 0
+        with memoryview(self._scratch) as data:
+            while written < self._pos:
+                written += os.write(self._fd, data[written : self._pos])
+        self._pos = 0
+
+    def _write_brush(self, brush):
+        """Append a single brush in Quake .map format to the scratch buffer"""
+        self._emit_box(*brush)
+        self.brush_id += 1
+
+    def _emit_box(self, min_point, max_point, texture):
+        """Append an axis-aligned box brush straight from its bounds"""
+        x1, y1, z1 = min_point
+        x2, y2, z2 = max_point
+        self._append(
+            self._BRUSH_FMT
+            % self._BOX_VALUES((x1, y1, z1, x2, y2, z2, self._textures[texture]))
+        )
 
-            # Format: ( x1 y1 z1 ) ( x2 y2 z2 ) ( x3 y3 z3 ) TEXTURE x_offset y_offset rotation x_scale y_scale
-            f.write(f"( {int(p1[0])} {int(p1[1])} {int(p1[2])} ) ")
-            f.write(f"( {int(p2[0])} {int(p2[1])} {int(p2[2])} ) ")
-            f.write(f"( {int(p3[0])} {int(p3[1])} {int(p3[2])} ) ")
-            f.write(f"{brush['texture']} 0 0 0 1 1\n")
 
-        f.write("}\n")
+def _format_brushes(brushes, textures):
+    """
+    Format a sequence of box brushes as one block of .map text, looking
+    encoded texture names up in textures
+    """
+    fmt = QuakeMapWriter._BRUSH_FMT
+    values = QuakeMapWriter._BOX_VALUES
+    return b"".join(
+        [
+            fmt % values((*min_point, *max_point, textures[texture]))
+            for min_point, max_point, texture in brushes
+        ]
+    )
 
 
 def create_hollow_room(
@@ -114,47 +338,37 @@ def create_hollow_room(
     x, y, z = origin
     w, d, h = size
 
-    brushes = []
-
     # Floor
-    floor = writer.create_box_brush((x, y, z), (x + w, y + d, z + thickness), floor_tex)
-    brushes.append(floor)
+    writer.write_worldspawn_brush((x, y, z), (x + w, y + d, z + thickness), floor_tex)
 
     # Ceiling
-    ceiling = writer.create_box_brush(
+    writer.write_worldspawn_brush(
         (x, y, z + h - thickness), (x + w, y + d, z + h), wall_tex
     )
-    brushes.append(ceiling)
 
     # North wall (back, +Y)
-    north = writer.create_box_brush(
+    writer.write_worldspawn_brush(
         (x, y + d - thickness, z + thickness),
         (x + w, y + d, z + h - thickness),
         wall_tex,
     )
-    brushes.append(north)
 
     # South wall (front, -Y)
-    south = writer.create_box_brush(
+    writer.write_worldspawn_brush(
         (x, y, z + thickness), (x + w, y + thickness, z + h - thickness), wall_tex
     )
-    brushes.append(south)
 
     # West wall (left, -X)
-    west = writer.create_box_brush(
+    writer.write_worldspawn_brush(
         (x, y, z + thickness), (x + thickness, y + d, z + h - thickness), wall_tex
     )
-    brushes.append(west)
 
     # East wall (right, +X)
-    east = writer.create_box_brush(
+    writer.write_worldspawn_brush(
         (x + w - thickness, y, z + thickness),
         (x + w, y + d, z + h - thickness),
         wall_tex,
     )
-    brushes.append(east)
-
-    return brushes
 
 
 def create_spiral_staircase(
@@ -164,36 +378,35 @@ def create_spiral_staircase(
     x, y, z = origin
     step_height = height / steps
     angle_per_step = 360 / steps
+    # Same factor math.radians() applies, hoisted out of the loop
+    deg_to_rad = math.pi / 180
+    cos, sin = math.cos, math.sin
     step_width = 48
     step_depth = 64
     step_thickness = 8
-
-    brushes = []
+    half_width = step_width / 2
+    half_depth = step_depth / 2
 
     for i in range(steps):
-        angle = math.radians(i * angle_per_step)
-        step_x = x + radius * math.cos(angle)
-        step_y = y + radius * math.sin(angle)
+        angle = i * angle_per_step * deg_to_rad
+        step_x = x + radius * cos(angle)
+        step_y = y + radius * sin(angle)
         step_z = z + i * step_height
 
         # Create a step
-        step = writer.create_box_brush(
-            (step_x - step_width / 2, step_y - step_depth / 2, step_z),
-            (step_x + step_width / 2, step_y + step_depth / 2, step_z + step_thickness),
+        writer.write_worldspawn_brush(
+            (step_x - half_width, step_y - half_depth, step_z),
+            (step_x + half_width, step_y + half_depth, step_z + step_thickness),
             texture,
         )
-        brushes.append(step)
-
-    return brushes
 
 
 def create_pillar(writer, origin, width, height, texture="__TB_empty"):
     """Create a simple pillar"""
     x, y, z = origin
-    pillar = writer.create_box_brush(
+    writer.write_worldspawn_brush(
         (x, y, z), (x + width, y + width, z + height), texture
     )
-    return [pillar]
 
 
 def create_platform(writer, origin, size, height, texture="__TB_empty"):
@@ -201,8 +414,7 @@ def create_platform(writer, origin, size, height, texture="__TB_empty"):
     x, y, z = origin
     w, d = size
 
-    platform = writer.create_box_brush((x, y, z), (x + w, y + d, z + height), texture)
-    return [platform]
+    writer.write_worldspawn_brush((x, y, z), (x + w, y + d, z + height), texture)
 
 
 # Example: Generate a complete map
@@ -211,77 +423,64 @@ def generate_example_map():
 
     writer = QuakeMapWriter("generated_map.map")
 
-    print("Generating map geometry...")
-
-    # Create main room
-    main_room = create_hollow_room(writer, (0, 0, 0), (512, 512, 256), thickness=16)
-
-    # Create second room
-    second_room = create_hollow_room(writer, (600, 0, 0), (512, 512, 256), thickness=16)
-
-    # Add connecting corridor walls (simplified - just remove one wall section)
-    # In practice, you'd create a proper corridor with doorway
-
-    # Add spiral staircase in main room
-    print("Adding spiral staircase...")
-    staircase = create_spiral_staircase(writer, (256, 256, 16), 100, 180, 20)
-
-    # Add some pillars
-    print("Adding decorative elements...")
-    pillar1 = create_pillar(writer, (100, 100, 16), 32, 128)
-    pillar2 = create_pillar(writer, (400, 100, 16), 32, 128)
-    pillar3 = create_pillar(writer, (100, 400, 16), 32, 128)
-    pillar4 = create_pillar(writer, (400, 400, 16), 32, 128)
-
-    # Add a raised platform in second room
-    platform = create_platform(writer, (700, 200, 16), (200, 150), 64)
-
-    # Combine all worldspawn geometry
-    all_brushes = (
-        main_room
-        + second_room
-        + staircase
-        + pillar1
-        + pillar2
-        + pillar3
-        + pillar4
-        + platform
-    )
+    # Worldspawn geometry is streamed to the file as it is generated
+    with writer:
+        print("Generating map geometry...")
+
+        # Create main room
+        create_hollow_room(writer, (0, 0, 0), (512, 512, 256), thickness=16)
+
+        # Create second room
+        create_hollow_room(writer, (600, 0, 0), (512, 512, 256), thickness=16)
+
+        # Add connecting corridor walls (simplified - just remove one wall section)
+        # In practice, you'd create a proper corridor with doorway
+
+        # Add spiral staircase in main room
+        print("Adding spiral staircase...")
+        create_spiral_staircase(writer, (256, 256, 16), 100, 180, 20)
+
+        # Add some pillars
+        print("Adding decorative elements...")
+        create_pillar(writer, (100, 100, 16), 32, 128)
+        create_pillar(writer, (400, 100, 16), 32, 128)
+        create_pillar(writer, (100, 400, 16), 32, 128)
+        create_pillar(writer, (400, 400, 16), 32, 128)
 
-    print(f"Total brushes: {len(all_brushes)}")
+        # Add a raised platform in second room
+        create_platform(writer, (700, 200, 16), (200, 150), 64)
 
-    writer.add_entity("worldspawn", brushes=all_brushes)
+        print(f"Total brushes: {writer.brush_id}")
 
-    # Add player start
-    print("Adding entities...")
-    writer.add_entity("info_player_start", {"origin": "256 256 32", "angle": "0"})
+        # Add player start
+        print("Adding entities...")
+        writer.add_entity("info_player_start", {"origin": "256 256 32", "angle": "0"})
 
-    # Add lights
-    writer.add_entity("light", {"origin": "256 256 180", "light": "300"})
+        # Add lights
+        writer.add_entity("light", {"origin": "256 256 180", "light": "300"})
 
-    writer.add_entity("light", {"origin": "856 256 180", "light": "300"})
+        writer.add_entity("light", {"origin": "856 256 180", "light": "300"})
 
-    writer.add_entity("light", {"origin": "100 100 150", "light": "200"})
+        writer.add_entity("light", {"origin": "100 100 150", "light": "200"})
 
-    writer.add_entity("light", {"origin": "400 400 150", "light": "200"})
+        writer.add_entity("light", {"origin": "400 400 150", "light": "200"})
 
-    # Add some monsters
-    writer.add_entity("monster_army", {"origin": "856 256 32", "angle": "180"})
+        # Add some monsters
+        writer.add_entity("monster_army", {"origin": "856 256 32", "angle": "180"})
 
-    writer.add_entity("monster_army", {"origin": "856 400 32", "angle": "180"})
+        writer.add_entity("monster_army", {"origin": "856 400 32", "angle": "180"})
 
-    writer.add_entity("monster_dog", {"origin": "700 300 90", "angle": "270"})
+        writer.add_entity("monster_dog", {"origin": "700 300 90", "angle": "270"})
 
-    # Add some items
-    writer.add_entity("weapon_supershotgun", {"origin": "400 256 32"})
+        # Add some items
+        writer.add_entity("weapon_supershotgun", {"origin": "400 256 32"})
 
-    writer.add_entity("item_health", {"origin": "256 400 32"})
+        writer.add_entity("item_health", {"origin": "256 400 32"})
 
-    writer.add_entity("item_shells", {"origin": "800 450 32"})
+        writer.add_entity("item_shells", {"origin": "800 450 32"})
 
-    # Write the file
-    print("Writing map file...")
-    writer.write()
+        # The file is finished when the block exits
+        print("Writing map file...")
     print(f"\n✓ Map generated: generated_map.map")
     print(f"\nNext steps:")
     print(f"1. Open in TrenchBroom to view and add textures")
@@ -0,0 +1,156 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import quake_map_generator
+from quake_map_generator import (
+    QuakeMapWriter,
+    create_hollow_room,
+    create_pillar,
+    create_spiral_staircase,
+)
+
+
+class QuakeMapWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.filename = os.path.join(tmpdir.name, "test.map")
+
+    def read_map(self, filename=None):
+        with open(filename or self.filename, "rb") as f:
+            return f.read()
+
+
+class TestEncoding(QuakeMapWriterTestCase):
+    def test_non_ascii_property_is_rejected_before_writing(self):
+        writer = QuakeMapWriter(self.filename)
+        with self.assertRaises(ValueError):
+            writer.add_entity("info_null", {"message": "café"})
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_non_ascii_texture_is_rejected(self):
+        writer = QuakeMapWriter(self.filename)
+        with self.assertRaises(ValueError):
+            writer.create_box_brush((0, 0, 0), (8, 8, 8), "café")
+
+
+class TestPropertyLines(QuakeMapWriterTestCase):
+    def test_equal_values_of_different_types_keep_their_own_text(self):
+        writer = QuakeMapWriter(self.filename)
+        writer.add_entity("light", {"light": 300.0})
+        writer.add_entity("light", {"light": 300})
+        writer.add_entity("info_null", {"spawnflags": True})
+        writer.add_entity("info_null", {"spawnflags": 1})
+        writer.write()
+
+        data = self.read_map()
+        self.assertIn(b'"light" "300.0"\n', data)
+        self.assertIn(b'"light" "300"\n', data)
+        self.assertIn(b'"spawnflags" "True"\n', data)
+        self.assertIn(b'"spawnflags" "1"\n', data)
+
+    def test_quotes_are_escaped_and_backslashes_kept(self):
+        writer = QuakeMapWriter(self.filename)
+        writer.add_entity("trigger_once", {"message": 'Say "hi"\\nLine two'})
+        writer.write()
+
+        self.assertIn(b'"message" "Say \\"hi\\"\\nLine two"\n', self.read_map())
+
+    def test_unhashable_value_is_written_with_str(self):
+        writer = QuakeMapWriter(self.filename)
+        writer.add_entity("info_null", {"origin": [1, 2, 3]})
+        writer.write()
+
+        self.assertIn(b'"origin" "[1, 2, 3]"\n', self.read_map())
+
+
+class TestStreaming(QuakeMapWriterTestCase):
+    def build_entities(self, writer):
+        writer.add_entity("light", {"origin": "0 0 64", "light": "300"})
+        door = writer.create_box_brush((0, 0, 0), (8, 8, 8))
+        writer.add_entity("func_door", {"angle": "90"}, [door])
+
+    def test_streamed_output_matches_queued_output(self):
+        queued = os.path.join(os.path.dirname(self.filename), "queued.map")
+        boxes = [
+            ((0, 0, 0), (512, 512, 16), "__TB_empty"),
+            ((10.7, -3.2, 0), (58.9, 60.1, 8.5), "__TB_empty"),
+            ((100, 100, 16), (132, 132, 144), "wall"),
+        ]
+
+        writer = QuakeMapWriter(queued)
+        writer.add_entity(
+            "worldspawn", brushes=[writer.create_box_brush(*box) for box in boxes]
+        )
+        self.build_entities(writer)
+        writer.write()
+
+        with QuakeMapWriter(self.filename) as writer:
+            for box in boxes:
+                writer.write_worldspawn_brush(*box)
+            self.build_entities(writer)
+
+        self.assertEqual(self.read_map(), self.read_map(queued))
+        self.assertEqual(writer.brush_id, len(boxes) + 1)
+
+    def test_helpers_stream_their_brushes(self):
+        with QuakeMapWriter(self.filename) as writer:
+            create_hollow_room(writer, (0, 0, 0), (512, 512, 256))
+            create_spiral_staircase(writer, (256, 256, 16), 100, 180, 20)
+            create_pillar(writer, (100, 100, 16), 32, 128)
+
+        self.assertEqual(writer.brush_id, 6 + 20 + 1)
+        self.assertEqual(self.read_map().count(b"{\n"), 1 + 6 + 20 + 1)
+
+    def test_write_worldspawn_brush_requires_open(self):
+        writer = QuakeMapWriter(self.filename)
+        with self.assertRaises(ValueError):
+            writer.write_worldspawn_brush((0, 0, 0), (8, 8, 8))
+
+    def test_close_requires_open(self):
+        writer = QuakeMapWriter(self.filename)
+        with self.assertRaises(ValueError):
+            writer.close()
+
+    def test_open_twice_is_rejected(self):
+        writer = QuakeMapWriter(self.filename)
+        writer.open()
+        self.addCleanup(writer.close)
+        with self.assertRaises(ValueError):
+            writer.open()
+        with self.assertRaises(ValueError):
+            writer.write()
+
+    def test_write_twice_counts_brushes_once(self):
+        writer = QuakeMapWriter(self.filename)
+        writer.add_entity(
+            "worldspawn", brushes=[writer.create_box_brush((0, 0, 0), (8, 8, 8))]
+        )
+        writer.write()
+        writer.write()
+        self.assertEqual(writer.brush_id, 1)
+
+    def test_error_in_with_block_removes_partial_file(self):
+        with self.assertRaises(KeyError):
+            with QuakeMapWriter(self.filename) as writer:
+                writer.write_worldspawn_brush((0, 0, 0), (8, 8, 8))
+                raise KeyError("boom")
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_error_in_close_removes_partial_file(self):
+        writer = QuakeMapWriter(self.filename)
+        writer.add_entity("light", {"origin": "0 0 0"})
+        with mock.patch.object(
+            quake_map_generator.os, "write", side_effect=OSError("disk full")
+        ):
+            with self.assertRaises(OSError):
+                with writer:
+                    writer.write_worldspawn_brush((0, 0, 0), (8, 8, 8))
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertIsNone(writer._fd)
+
+
+if __name__ == "__main__":
+    unittest.main()